@@ -5,12 +5,21 @@
 Common data processing utilities that are used in a
 typical object detection data pipeline.
 """
+import io
 import logging
 import numpy as np
 import pycocotools.mask as mask_util
 import torch
 from PIL import Image
 
+try:
+    from turbojpeg import TJPF_BGR, TJPF_RGB, TurboJPEG
+
+    _turbo_jpeg = TurboJPEG()
+except (ImportError, RuntimeError, OSError):
+    # PyTurboJPEG (and the libturbojpeg it loads) is an optional dependency
+    _turbo_jpeg = None
+
 from detectron2.structures import (
     BitMasks,
     Boxes,
@@ -174,13 +183,30 @@ def read_image(file_name, format=None):
     Returns:
         image (np.ndarray): an HWC image in the given format, which is 0-255, uint8 for
             supported image modes in PIL or "BGR"; float (0-1 for Y) for YUV-BT.601.
+
+    If PyTurboJPEG is installed, "RGB" and "BGR" JPEGs without exif rotation are decoded
+    with libjpeg-turbo instead of PIL.
     """
     with PathManager.open(file_name, "rb") as f:
-        image = Image.open(f)
+        use_turbo_jpeg = _turbo_jpeg is not None and format in ["BGR", "RGB"]
+        if use_turbo_jpeg:
+            buf = f.read()
+            # PIL only parses the header here, the pixels are decoded lazily
+            image = Image.open(io.BytesIO(buf))
+        else:
+            image = Image.open(f)
 
         # work around this bug: https://github.com/python-pillow/Pillow/issues/3973
-        image = _apply_exif_orientation(image)
-        return convert_PIL_to_numpy(image, format)
+        oriented = _apply_exif_orientation(image)
+        if (
+            use_turbo_jpeg
+            and oriented is image
+            and image.format == "JPEG"
+            and image.mode in ["RGB", "L"]
+        ):
+            pixel_format = TJPF_BGR if format == "BGR" else TJPF_RGB
+            return _turbo_jpeg.decode(buf, pixel_format=pixel_format)
+        return convert_PIL_to_numpy(oriented, format)
 
 
 def check_image_size(dataset_dict, image):
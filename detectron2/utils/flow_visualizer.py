@@ -10,7 +10,11 @@
 """
 
 import numpy as np
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import cv2
+
 import detectron2.data.detection_utils as utils
 from detectron2.data.flow_utils import read_flow
 
@@ -29,7 +33,7 @@ def make_color_wheel():
 
     ncols = RY + YG + GC + CB + BM + MR
 
-    colorwheel = np.zeros([ncols, 3])
+    colorwheel = np.zeros([ncols, 3], dtype=np.uint8)
 
     col = 0
 
@@ -65,89 +69,209 @@ def make_color_wheel():
     return colorwheel
 
 
-def compute_color(u, v):
+def make_flow_lut(colorwheel, size=1024):
     """
-    compute optical flow color map
-    :param u: horizontal optical flow
-    :param v: vertical optical flow
-    :return:
+    Tabulate the color wheel interpolation over the normalized flow angle
+    :param colorwheel: color wheel generated by make_color_wheel()
+    :param size: number of samples over the angle range [-1, 1]
+    :return: (size, 3) color table in [0, 255]
     """
+    ncols = np.size(colorwheel, 0)
 
-    height, width = u.shape
-    img = np.zeros((height, width, 3))
+    a = np.linspace(-1, 1, size)
+    fk = (a + 1) / 2 * (ncols - 1) + 1
+    k0 = np.floor(fk).astype(int)
+    k1 = k0 + 1
+    k1[k1 == ncols + 1] = 1
+    f = (fk - k0)[:, np.newaxis]
 
-    NAN_idx = np.isnan(u) | np.isnan(v)
-    u[NAN_idx] = v[NAN_idx] = 0
+    col0 = colorwheel[k0 - 1]
+    col1 = colorwheel[k1 - 1]
+    return ((1 - f) * col0 + f * col1).astype(np.float32)
 
-    colorwheel = make_color_wheel()
-    ncols = np.size(colorwheel, 0)
 
-    rad = np.sqrt(u ** 2 + v ** 2)
+_COLOR_WHEEL = make_color_wheel()
+_FLOW_LUT = make_flow_lut(_COLOR_WHEEL)
 
-    a = np.arctan2(-v, -u) / np.pi
+# per-thread scratch and output buffers of compute_color
+_BUF_CACHE = threading.local()
 
-    fk = (a + 1) / 2 * (ncols - 1) + 1
 
-    k0 = np.floor(fk).astype(int)
+def _get_buffers(height, width):
+    # only the buffers of the last (height, width) seen by this thread are kept
+    if getattr(_BUF_CACHE, "shape", None) != (height, width):
+        _BUF_CACHE.shape = (height, width)
+        _BUF_CACHE.col = np.empty((height, width, 3), dtype=np.float32)
+        _BUF_CACHE.img = np.empty((height, width, 3), dtype=np.uint8)
+    return _BUF_CACHE.col, _BUF_CACHE.img
 
-    k1 = k0 + 1
-    k1[k1 == ncols + 1] = 1
-    f = fk - k0
 
-    for i in range(0, np.size(colorwheel, 1)):
-        tmp = colorwheel[:, i]
-        col0 = tmp[k0 - 1] / 255
-        col1 = tmp[k1 - 1] / 255
-        col = (1 - f) * col0 + f * col1
+def compute_color(u, v, rad=None, invalid_mask=None, reuse_buffer=False):
+    """
+    compute optical flow color map
+    :param u: horizontal optical flow
+    :param v: vertical optical flow
+    :param rad: optional precomputed flow magnitude sqrt(u ** 2 + v ** 2)
+    :param invalid_mask: optional boolean mask of pixels to render black
+    :param reuse_buffer: compute into per-thread buffers reused by consecutive calls
+        with the same (H, W). The returned array is then overwritten by the next such
+        call, so callers that keep it must .copy() it.
+    :return:
+    """
+
+    # NaN-free flow is the common case, only build the NaN mask when needed
+    if np.isnan(u).any() or np.isnan(v).any():
+        NAN_idx = np.isnan(u) | np.isnan(v)
+        u[NAN_idx] = v[NAN_idx] = 0
+        if rad is not None:
+            rad[NAN_idx] = 0
+        invalid_mask = NAN_idx if invalid_mask is None else NAN_idx | invalid_mask
 
-        idx = rad <= 1
-        col[idx] = 1 - rad[idx] * (1 - col[idx])
-        notidx = np.logical_not(idx)
+    if rad is None:
+        rad = np.sqrt(u ** 2 + v ** 2)
 
-        col[notidx] *= 0.75
-        img[:, :, i] = np.uint8(np.floor(255 * col * (1 - NAN_idx)))
+    # angle in [-1, 1] -> nearest sample of the precomputed color table
+    a = np.arctan2(-v, -u) / np.pi
+    lut_idx = np.rint((a + 1) * (0.5 * (len(_FLOW_LUT) - 1))).astype(np.intp)
+
+    if reuse_buffer:
+        col, img = _get_buffers(*u.shape)
+    else:
+        col = np.empty(u.shape + (3,), dtype=np.float32)
+        img = np.empty(u.shape + (3,), dtype=np.uint8)
+
+    # 255 - rad * (255 - col), computed in place; lut_idx is always in range
+    np.take(_FLOW_LUT, lut_idx, axis=0, out=col, mode="clip")
+    np.subtract(255, col, out=col)
+    np.multiply(col, rad[:, :, np.newaxis], out=col)
+    np.subtract(255, col, out=col)
+    out_of_range = rad > 1
+    if out_of_range.any():
+        np.copyto(col, _FLOW_LUT[lut_idx] * 0.75, where=out_of_range[:, :, np.newaxis])
+    if invalid_mask is not None:
+        np.copyto(col, 0, where=invalid_mask[:, :, np.newaxis])
+    # col is already in [0, 255], truncating to uint8 is the floor
+    np.copyto(img, col, casting="unsafe")
 
     return img
 
 
-def flow2img(flow_data):
+def flow2img(flow_data, reuse_buffer=False):
     """
     convert optical flow into color image
     :param flow_data:
+    :param reuse_buffer: see compute_color
     :return: color image
     """
     # print(flow_data.shape)
     # print(type(flow_data))
-    u = flow_data[:, :, 0]
-    v = flow_data[:, :, 1]
+    u = flow_data[:, :, 0].astype(np.float32, copy=True)
+    v = flow_data[:, :, 1].astype(np.float32, copy=True)
+
+    # NaN fails both comparisons, so it is treated as unknown flow as well; otherwise it
+    # would poison maxrad below
+    UNKNOW_FLOW_THRESHOLD = 1e7
+    idx_unknown = ~((np.abs(u) <= UNKNOW_FLOW_THRESHOLD) & (np.abs(v) <= UNKNOW_FLOW_THRESHOLD))
+    if idx_unknown.all():
+        return np.zeros(flow_data.shape[:2] + (3,), dtype=np.uint8)
+    u[idx_unknown] = v[idx_unknown] = 0
+
+    rad = np.sqrt(u * u + v * v)
+    maxrad = max(-1, np.max(rad)) + np.finfo(np.float32).eps
+    # normalize the magnitude along with u, v so compute_color does not recompute it
+    rad /= maxrad
+    u /= maxrad
+    v /= maxrad
+
+    # unknown pixels are blanked inside compute_color's final pass
+    return compute_color(
+        u, v, rad, idx_unknown if idx_unknown.any() else None, reuse_buffer=reuse_buffer
+    )
+
+
+def flow2img_hsv(flow_data):
+    """
+    convert optical flow into color image with OpenCV's HSV to BGR conversion:
+    hue encodes the flow direction and value the normalized magnitude.
+    Faster than flow2img, but it does not use the Middlebury color wheel.
+    :param flow_data:
+    :return: color image, in BGR
+    """
+    u = flow_data[:, :, 0].astype(np.float32)
+    v = flow_data[:, :, 1].astype(np.float32)
 
+    # unknown and NaN flow get zero magnitude, i.e. they are rendered black
     UNKNOW_FLOW_THRESHOLD = 1e7
-    pr1 = abs(u) > UNKNOW_FLOW_THRESHOLD
-    pr2 = abs(v) > UNKNOW_FLOW_THRESHOLD
-    idx_unknown = (pr1 | pr2)
+    idx_unknown = ~((np.abs(u) <= UNKNOW_FLOW_THRESHOLD) & (np.abs(v) <= UNKNOW_FLOW_THRESHOLD))
     u[idx_unknown] = v[idx_unknown] = 0
 
-    # get max value in each direction
-    maxu = -999.
-    maxv = -999.
-    minu = 999.
-    minv = 999.
-    maxu = max(maxu, np.max(u))
-    maxv = max(maxv, np.max(v))
-    minu = min(minu, np.min(u))
-    minv = min(minv, np.min(v))
+    mag, ang = cv2.cartToPolar(u, v)
+    maxmag = max(float(mag.max()), np.finfo(np.float32).eps)
+
+    hsv = np.empty(u.shape + (3,), dtype=np.uint8)
+    hsv[:, :, 0] = ang * (90 / np.pi)  # OpenCV's 8-bit hue is in [0, 180)
+    hsv[:, :, 1] = 255
+    hsv[:, :, 2] = np.clip(mag * (255 / maxmag), 0, 255)
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+def _stack_sample(image1, image2, flow_img, flip_channels=False):
+    """
+    Stack the two images and the flow color map vertically into one preallocated buffer
+    """
+    blocks = [image1, image2, flow_img]
+    # like np.concatenate, the blocks may differ in height but not in width
+    assert image1.shape[1] == image2.shape[1] == flow_img.shape[1], (
+        "Different width between images and flow: img1({}), img2({}), flow({})".format(
+            image1.shape[1], image2.shape[1], flow_img.shape[1]
+        )
+    )
+    img = np.empty(
+        (sum(x.shape[0] for x in blocks), image1.shape[1], 3),
+        dtype=np.result_type(*blocks),
+    )
+    top = 0
+    for x in blocks:
+        # the channel flip is a view, it is applied by the copy itself
+        img[top:top + x.shape[0]] = x[:, :, ::-1] if flip_channels else x
+        top += x.shape[0]
+    return img
 
-    rad = np.sqrt(u ** 2 + v ** 2)
-    maxrad = max(-1, np.max(rad))
-    u = u / maxrad + np.finfo(float).eps
-    v = v / maxrad + np.finfo(float).eps
 
-    img = compute_color(u, v)
+def _load_sample(image_file1, image_file2, flow_map_file):
+    image1 = utils.read_image(image_file1, format="BGR")
+    image2 = utils.read_image(image_file2, format="BGR")
+    flow_map = flow2img(read_flow(flow_map_file))
+    return image1, image2, flow_map
 
-    idx = np.repeat(idx_unknown[:, :, np.newaxis], 3, axis=2)
-    img[idx] = 0
 
-    return np.uint8(img)
+def prefetch_samples(triples, n=4):
+    """
+    Load samples in background threads, keeping at most n of them in flight.
+    The two images and the flow map of a sample are read concurrently.
+    :param triples: iterable of (image_file1, image_file2, flow_map_file)
+    :param n: number of reader threads
+    :return: generator of (image1, image2, flow color image), in the order of triples
+    """
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        pending = deque()
+
+        def _next_sample():
+            image1, image2, flow_map = (x.result() for x in pending.popleft())
+            return image1, image2, flow2img(flow_map)
+
+        for image_file1, image_file2, flow_map_file in triples:
+            pending.append(
+                (
+                    pool.submit(utils.read_image, image_file1, format="BGR"),
+                    pool.submit(utils.read_image, image_file2, format="BGR"),
+                    pool.submit(read_flow, flow_map_file),
+                )
+            )
+            if len(pending) >= n:
+                yield _next_sample()
+        while pending:
+            yield _next_sample()
 
 
 def visualize_sample_from_array(image1, image2, flow_map, img_format="BGR", save=False):
@@ -160,12 +284,7 @@ def visualize_sample_from_array(image1, image2, flow_map, img_format="BGR", save
     )
 
     flow_map = flow2img(flow_map)
-    if img_format == "RGB":
-        image1 = image1[:, :, ::-1]
-        image2 = image2[:, :, ::-1]
-        flow_map = flow_map[:, :, ::-1]
-
-    img = np.concatenate([image1, image2, flow_map], axis=0)
+    img = _stack_sample(image1, image2, flow_map, flip_channels=img_format == "RGB")
 
     if save:
         cv2.imwrite("visualize_sample_from_array.jpg", img)
@@ -181,11 +300,7 @@ def visualize_sample_from_file(image_file1=None, image_file2=None, flow_map_file
     print("  image file 2: {}".format(image_file2))
     print("  flow map file: {}".format(flow_map_file))
 
-    image1 = utils.read_image(image_file1, format="BGR")
-    image2 = utils.read_image(image_file2, format="BGR")
-    flow_map = flow2img(read_flow(flow_map_file))
-
-    img = np.concatenate([image1, image2, flow_map], axis=0)
+    img = _stack_sample(*_load_sample(image_file1, image_file2, flow_map_file))
 
     if save:
         cv2.imwrite("visualize_sample_from_file.jpg", img)
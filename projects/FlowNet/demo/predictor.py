@@ -89,7 +89,10 @@ class VisualizationDemo(object):
         """
         # Convert image from OpenCV BGR format to Matplotlib RGB format.
         image1 = images[0][:, :, ::-1]
-        flow_image = flow2img(predictions["flow"].permute(1, 2, 0).detach().cpu().numpy())
+        # the flow image is copied by np.concatenate below, so its buffer can be reused
+        flow_image = flow2img(
+            predictions["flow"].permute(1, 2, 0).detach().cpu().numpy(), reuse_buffer=True
+        )
         output_image = np.concatenate([image1, flow_image], axis=0)
         return output_image
 
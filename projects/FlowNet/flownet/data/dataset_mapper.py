@@ -9,9 +9,10 @@
 @Desc         : None
 """
 
-import copy
 import logging
 import numpy as np
+import os
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Union
 import torch
 
@@ -26,6 +27,8 @@ This file contains the default mapping that's applied to "dataset dicts".
 
 __all__ = ["DatasetMapper"]
 
+logger = logging.getLogger(__name__)
+
 
 def build_augmentation(cfg, is_train):
     """
@@ -100,9 +103,11 @@ class DatasetMapper:
         self.augmentations = T.AugmentationList(augmentations)
         self.image_format = image_format
         # fmt: on
-        logger = logging.getLogger(__name__)
+        self._io_pool = None
+        self._io_pool_pid = None
         mode = "training" if is_train else "inference"
-        logger.info(f"[DatasetMapper] Augmentations used in {mode}: {augmentations}")
+        # lazy %-formatting: the augmentation list is only stringified if INFO is enabled
+        logger.info("[DatasetMapper] Augmentations used in %s: %s", mode, augmentations)
 
     @classmethod
     def from_config(cls, cfg, is_train: bool = True):
@@ -114,6 +119,20 @@ class DatasetMapper:
         }
         return ret
 
+    def __getstate__(self):
+        # thread pools can't be pickled into dataloader workers, each process makes its own
+        state = self.__dict__.copy()
+        state["_io_pool"] = None
+        state["_io_pool_pid"] = None
+        return state
+
+    def _get_io_pool(self):
+        # a forked worker inherits the pool object but not its threads
+        if self._io_pool_pid != os.getpid():
+            self._io_pool = ThreadPoolExecutor(max_workers=2)
+            self._io_pool_pid = os.getpid()
+        return self._io_pool
+
     def __call__(self, dataset_dict):
         """
         Args:
@@ -122,16 +141,22 @@ class DatasetMapper:
         Returns:
             dict: a format that builtin models in detectron2 accept
         """
-        dataset_dict = copy.deepcopy(dataset_dict)  # it will be modified by code below
+        # Flow dataset dicts only hold file names, and the code below only adds new keys,
+        # so a shallow copy is enough to keep the original dict untouched.
+        dataset_dict = dict(dataset_dict)
 
         # image1 = utils.convert_PIL_to_numpy(
         #     Image.open(dataset_dict["image_file1"]), format=self.image_format)
         # image2 = utils.convert_PIL_to_numpy(
         #     Image.open(dataset_dict["image_file2"]), format=self.image_format)
+        # Read image2 and the flow map in the background (decoding releases the GIL),
+        # while image1 is read and its augmentations are sampled in this thread.
+        io_pool = self._get_io_pool()
+        image2_future = io_pool.submit(
+            utils.read_image, dataset_dict["image_file2"], format=self.image_format
+        )
+        flow_map_future = io_pool.submit(flow_utils.read_flow, dataset_dict["flow_map_file"])
         image1 = utils.read_image(dataset_dict["image_file1"], format=self.image_format)
-        image2 = utils.read_image(dataset_dict["image_file2"], format=self.image_format)
-        flow_map = flow_utils.read_flow(dataset_dict["flow_map_file"])
-        _check_shape(image1, image2, flow_map)
 
         height, width = image1.shape[:2]  # h, w
         dataset_dict["height"] = height
@@ -140,6 +165,10 @@ class DatasetMapper:
         # Apply augmentations
         aug_input = T.AugInput(image=image1)
         transforms = self.augmentations(aug_input)
+        image2 = image2_future.result()
+        flow_map = flow_map_future.result()
+        _check_shape(image1, image2, flow_map)
+
         image1 = aug_input.image
         image2 = transforms.apply_image2(image2)
         flow_map = transforms.apply_flow(flow_map)
@@ -158,11 +187,12 @@ class DatasetMapper:
         #     save=True
         # )
 
-        dataset_dict["image1"] = torch.as_tensor(
-            np.ascontiguousarray(image1.transpose(2, 0, 1)))
-        dataset_dict["image2"] = torch.as_tensor(
-            np.ascontiguousarray(image2.transpose(2, 0, 1)))
-        dataset_dict["flow_map"] = torch.as_tensor(
-            np.ascontiguousarray(flow_map.transpose(2, 0, 1)))
+        # Permute to (C, H, W) as a view of the HWC buffer instead of copying it into a
+        # contiguous CHW array; the model's preprocessing does not need contiguous inputs.
+        # ascontiguousarray is a no-op unless an augmentation returned a strided view.
+        dataset_dict["image1"] = torch.from_numpy(np.ascontiguousarray(image1)).permute(2, 0, 1)
+        dataset_dict["image2"] = torch.from_numpy(np.ascontiguousarray(image2)).permute(2, 0, 1)
+        dataset_dict["flow_map"] = torch.from_numpy(
+            np.ascontiguousarray(flow_map)).permute(2, 0, 1)
 
         return dataset_dict
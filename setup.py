@@ -208,6 +208,7 @@ setup(
             "shapely",
             "psutil",
             "panopticapi @ https://github.com/cocodataset/panopticapi/archive/master.zip",
+            "PyTurboJPEG",  # faster JPEG decoding in read_image, needs libturbojpeg
         ],
         "dev": [
             "flake8==3.8.1",
@@ -3,8 +3,11 @@
 import copy
 import numpy as np
 import os
+import tempfile
 import unittest
+from unittest import mock
 import pycocotools.mask as mask_util
+from PIL import Image
 
 from detectron2.data import MetadataCatalog, detection_utils
 from detectron2.data import transforms as T
@@ -152,5 +155,42 @@ class TestTransformAnnotations(unittest.TestCase):
         self.assertEqual(sem_seg.min(), 1)
 
 
+class TestReadImageTurboJPEG(unittest.TestCase):
+    def test_turbo_jpeg_dispatch(self):
+        image = Image.fromarray(np.random.randint(0, 255, (8, 6, 3), dtype=np.uint8))
+        decoded = np.zeros((8, 6, 3), dtype=np.uint8)
+        turbo = mock.MagicMock()
+        turbo.decode.return_value = decoded
+
+        with tempfile.TemporaryDirectory() as d, mock.patch.object(
+            detection_utils, "_turbo_jpeg", turbo
+        ), mock.patch.object(detection_utils, "TJPF_BGR", "bgr", create=True), mock.patch.object(
+            detection_utils, "TJPF_RGB", "rgb", create=True
+        ):
+            jpg_file = os.path.join(d, "plain.jpg")
+            image.save(jpg_file)
+            png_file = os.path.join(d, "plain.png")
+            image.save(png_file)
+            rotated_file = os.path.join(d, "rotated.jpg")
+            exif = Image.Exif()
+            exif[274] = 6  # rotate 90 degrees clockwise
+            image.save(rotated_file, exif=exif.tobytes())
+            cmyk_file = os.path.join(d, "cmyk.jpg")
+            Image.new("CMYK", (6, 8)).save(cmyk_file)
+
+            # these fall back to PIL
+            self.assertEqual(detection_utils.read_image(png_file, "BGR").shape, (8, 6, 3))
+            self.assertEqual(detection_utils.read_image(rotated_file, "BGR").shape, (6, 8, 3))
+            self.assertEqual(detection_utils.read_image(cmyk_file, "RGB").shape, (8, 6, 3))
+            self.assertEqual(detection_utils.read_image(jpg_file, "L").shape, (8, 6, 1))
+            turbo.decode.assert_not_called()
+
+            self.assertIs(detection_utils.read_image(jpg_file, "BGR"), decoded)
+            self.assertEqual(turbo.decode.call_args[1]["pixel_format"], "bgr")
+            self.assertIs(detection_utils.read_image(jpg_file, "RGB"), decoded)
+            self.assertEqual(turbo.decode.call_args[1]["pixel_format"], "rgb")
+            self.assertEqual(turbo.decode.call_count, 2)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) Facebook, Inc. and its affiliates.
+
+import numpy as np
+import time
+import unittest
+from unittest import mock
+import cv2
+
+from detectron2.utils import flow_visualizer
+from detectron2.utils.flow_visualizer import (
+    flow2img,
+    flow2img_hsv,
+    make_color_wheel,
+    prefetch_samples,
+)
+
+
+def _reference_flow2img(flow_data):
+    """
+    The original float64 floor/interp Middlebury implementation that flow2img must stay
+    close to, for flow without NaN. It normalizes by maxrad + eps like flow2img does,
+    instead of adding eps to u and v, so that rad never exceeds 1.
+    """
+    u = flow_data[:, :, 0].astype(np.float64)
+    v = flow_data[:, :, 1].astype(np.float64)
+    idx_unknown = (abs(u) > 1e7) | (abs(v) > 1e7)
+    u[idx_unknown] = v[idx_unknown] = 0
+
+    maxrad = max(-1, np.max(np.sqrt(u ** 2 + v ** 2))) + np.finfo(np.float32).eps
+    u = u / maxrad
+    v = v / maxrad
+
+    colorwheel = make_color_wheel().astype(np.float64)
+    ncols = np.size(colorwheel, 0)
+    rad = np.sqrt(u ** 2 + v ** 2)
+    a = np.arctan2(-v, -u) / np.pi
+    fk = (a + 1) / 2 * (ncols - 1) + 1
+    k0 = np.floor(fk).astype(int)
+    k1 = k0 + 1
+    k1[k1 == ncols + 1] = 1
+    f = fk - k0
+
+    img = np.zeros(u.shape + (3,), dtype=np.uint8)
+    for i in range(3):
+        tmp = colorwheel[:, i]
+        col = (1 - f) * tmp[k0 - 1] / 255 + f * tmp[k1 - 1] / 255
+        idx = rad <= 1
+        col[idx] = 1 - rad[idx] * (1 - col[idx])
+        col[~idx] *= 0.75
+        img[:, :, i] = np.floor(255 * col)
+    img[idx_unknown] = 0
+    return img
+
+
+class TestFlow2Img(unittest.TestCase):
+    def _random_flow(self, H=60, W=80):
+        np.random.seed(125)
+        return (np.random.rand(H, W, 2).astype(np.float32) - 0.5) * 20
+
+    def test_matches_reference(self):
+        flow = self._random_flow()
+        flow[:5, :5] = 1e8  # unknown flow
+        img = flow2img(flow).astype(np.int32)
+        ref = _reference_flow2img(flow).astype(np.int32)
+        self.assertEqual(img.shape, ref.shape)
+        # the angle lookup table quantizes the color wheel interpolation
+        self.assertLessEqual(np.abs(img - ref).max(), 2)
+        self.assertTrue((img[:5, :5] == 0).all())
+
+    def test_input_not_modified(self):
+        flow = self._random_flow()
+        flow[0, 0] = 1e8
+        flow[1, 1, 1] = np.nan
+        flow_copy = flow.copy()
+        flow2img(flow)
+        np.testing.assert_array_equal(flow, flow_copy)
+
+    def test_all_unknown(self):
+        flow = np.full((20, 30, 2), 1e8, dtype=np.float32)
+        img = flow2img(flow)
+        self.assertEqual(img.shape, (20, 30, 3))
+        self.assertEqual(img.dtype, np.uint8)
+        self.assertTrue((img == 0).all())
+
+    def test_nan_is_unknown(self):
+        flow = self._random_flow()
+        flow_nan = flow.copy()
+        flow_nan[0, 0, 0] = np.nan
+        flow_unknown = flow.copy()
+        flow_unknown[0, 0, 0] = 1e8
+
+        img = flow2img(flow_nan)
+        self.assertTrue((img[0, 0] == 0).all())
+        self.assertTrue((img == flow2img(flow_unknown)).all())
+
+    def test_zero_flow(self):
+        img = flow2img(np.zeros((20, 30, 2), dtype=np.float32))
+        self.assertEqual(img.shape, (20, 30, 3))
+        self.assertEqual(img.dtype, np.uint8)
+        # zero motion is the center of the color wheel, i.e. white
+        self.assertTrue((img == 255).all())
+
+    def test_reuse_buffer(self):
+        img1 = flow2img(self._random_flow(), reuse_buffer=True)
+        img2 = flow2img(self._random_flow(), reuse_buffer=True)
+        self.assertTrue(np.shares_memory(img1, img2))
+
+        img3 = flow2img(self._random_flow())
+        img4 = flow2img(self._random_flow())
+        self.assertFalse(np.shares_memory(img3, img4))
+        self.assertFalse(np.shares_memory(img2, img3))
+
+
+class TestFlow2ImgHSV(unittest.TestCase):
+    def test_flow2img_hsv(self):
+        flow = np.zeros((2, 4, 2), dtype=np.float32)
+        # +x, +y, -x, -y
+        flow[0, :, 0] = [1, 0, -1, 0]
+        flow[0, :, 1] = [0, 1, 0, -1]
+        flow[1, 0] = 1e8
+        flow[1, 1] = np.nan
+
+        img = flow2img_hsv(flow)
+        self.assertEqual(img.shape, (2, 4, 3))
+        self.assertEqual(img.dtype, np.uint8)
+        self.assertTrue((img[1] == 0).all())
+
+        # hue follows the direction, in OpenCV's [0, 180) 8-bit hue range
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        self.assertTrue(np.allclose(hsv[0, :, 0], [0, 45, 90, 135], atol=2))
+        self.assertTrue((hsv[0, :, 2] == 255).all())
+
+
+class TestPrefetchSamples(unittest.TestCase):
+    def _patch_readers(self):
+        def read_image(file_name, format=None):
+            # later samples finish first, so the order has to be restored by prefetch_samples
+            time.sleep(0.002 * (10 - file_name % 10))
+            return np.full((4, 5, 3), file_name, dtype=np.uint8)
+
+        def read_flow(file_name):
+            return np.zeros((4, 5, 2), dtype=np.float32)
+
+        return (
+            mock.patch.object(flow_visualizer.utils, "read_image", side_effect=read_image),
+            mock.patch.object(flow_visualizer, "read_flow", side_effect=read_flow),
+        )
+
+    def test_order(self):
+        triples = [(i, i + 100, i) for i in range(10)]
+        patch_image, patch_flow = self._patch_readers()
+        with patch_image, patch_flow:
+            samples = list(prefetch_samples(triples, n=3))
+        self.assertEqual(len(samples), len(triples))
+        for i, (image1, image2, flow_img) in enumerate(samples):
+            self.assertTrue((image1 == i).all())
+            self.assertTrue((image2 == i + 100).all())
+            self.assertEqual(flow_img.shape, (4, 5, 3))
+
+    def test_empty(self):
+        self.assertEqual(list(prefetch_samples([])), [])
+
+    def test_close(self):
+        triples = [(i, i + 100, i) for i in range(10)]
+        patch_image, patch_flow = self._patch_readers()
+        with patch_image, patch_flow:
+            samples = prefetch_samples(triples, n=2)
+            image1, _, _ = next(samples)
+            self.assertTrue((image1 == 0).all())
+            samples.close()
+            with self.assertRaises(StopIteration):
+                next(samples)